@@ -1,19 +1,70 @@
 import os
+import time
+import tempfile
 import datetime
 import altair as alt
 import numpy as np
 import pandas as pd
 import pydeck as pdk
 import streamlit as st
-from database import Database
+from database import Database, chave_dia
+from ingest import Ingestion
 
 # SETTING PAGE CONFIG TO WIDE MODE AND ADDING A TITLE AND FAVICON
 st.set_page_config(layout="wide", page_title="BATrânsito", page_icon=":taxi:")
 
+@st.cache_resource
+def ingestao():
+    # um build por processo; o lock em Ingestion cuida dos demais processos
+    return Ingestion().start()
+
+def progresso(status):
+    fase = status.get("fase")
+    if fase == "download":
+        total = status.get("total")
+        mb = status["bytes"] / 2**20
+        if total:
+            st.progress(min(status["bytes"] / total, 1.0), f"Baixando dados: {mb:.1f} MB")
+        else:
+            st.progress(0.0, f"Baixando dados: {mb:.1f} MB")
+    elif fase == "extracao":
+        st.progress(0.0, "Extraindo arquivo")
+    elif fase == "carga":
+        st.progress(0.0, f"Carregando linhas: {status['linhas']:,}")
+    elif fase == "populacao":
+        st.progress(
+            status["feitas"] / status["total"],
+            f"Tabela {status['tabela']} ({status['feitas']}/{status['total']}): "
+            f"{status['linhas']:,} linhas em {status['segundos']:.1f}s"
+        )
+    else:
+        st.progress(0.0, "Iniciando")
+
+ingestion = ingestao()
+if not ingestion.ready():
+    st.title("Boletim de Acidente de Trânsito (BAT)")
+    st.info("Preparando o banco de dados. A página atualiza sozinha quando terminar.")
+
+    status = ingestion.status()
+    if status.get("fase") == "erro" and not ingestion.running():
+        st.error(f"Falha ao construir o banco: {status['erro']}")
+        if st.button("Tentar novamente"):
+            ingestion.start()
+            st.rerun()
+        st.stop()
+
+    ingestion.start()
+    progresso(status)
+    time.sleep(1)
+    st.rerun()
+
 db =  Database()
-db.download_and_extract()
-db.create_db()
-db.populate_db()
+
+# modo aproximado: consultas pesadas respondidas pelas amostras estratificadas
+aproximado = st.sidebar.toggle("Modo aproximado", key="aproximado")
+erro_max = st.sidebar.slider(
+    "Erro relativo máximo", 0.01, 0.5, 0.1, format="%.2f", key="erro_max", disabled=not aproximado
+)
 
 st.title("Boletim de Acidente de Trânsito (BAT)")
 st.markdown("## Preview das localizações dos acidentes")
@@ -46,28 +97,95 @@ def map(data, lat, lon, zoom, radius, escale, erange, color, pitch=35, cov=1):
         )
     )
 
+def viewport(lat, lon, zoom, largura=1200, altura=500):
+    # janela (lat/lon) visivel no mapa para o centro e zoom dados
+    graus_px = 360 / (256 * 2 ** zoom)
+    dlon = graus_px * largura / 2
+    dlat = graus_px * altura / 2 * np.cos(np.radians(lat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+def enquadrar(min_lat, min_lon, max_lat, max_lon, largura=1200, altura=500, maximo=10):
+    # centro e zoom em que a janela cabe no mapa (o inverso de viewport)
+    lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    zoom_lon = np.log2(360 * largura / (256 * max(max_lon - min_lon, 1e-6)))
+    zoom_lat = np.log2(360 * altura * np.cos(np.radians(lat)) / (256 * max(max_lat - min_lat, 1e-6)))
+    return lat, lon, float(min(zoom_lon, zoom_lat, maximo))
+
 @st.cache_data
-def load_data(uf, limit):
+def extensao_uf(uf):
+    # janela com os acidentes do estado, sem o 1% mais extremo de cada lado
+    # (coordenadas erradas caem longe e ampliariam demais a janela)
     return db.fetch(
-        f"""
-        SELECT 
-            COUNT(*) as qntd, 
-            Latitude as lat, 
-            Longitude as lon 
-        FROM 
-            Acidente ac
-        LEFT JOIN Trecho t
-            ON ac.TID = t.ID
-        LEFT JOIN Municipio m
-            ON t.MID = m.ID
-        WHERE m.UF = '{uf}'
-        GROUP BY 
-            Latitude, Longitude 
-        ORDER BY qntd DESC 
-        LIMIT {limit}
         """
+        WITH pontos AS (
+            SELECT g.min_lat AS lat, g.min_lon AS lon
+            FROM Acidente_geo g
+            JOIN Acidente ac
+                ON ac.ID = g.ID
+            JOIN Trecho t
+                ON ac.TID = t.ID
+            JOIN Municipio m
+                ON t.MID = m.ID
+            WHERE m.UF = ?
+        ),
+        lats AS (SELECT lat, ROW_NUMBER() OVER (ORDER BY lat) AS i, COUNT(*) OVER () AS n FROM pontos),
+        lons AS (SELECT lon, ROW_NUMBER() OVER (ORDER BY lon) AS i, COUNT(*) OVER () AS n FROM pontos)
+        SELECT
+            (SELECT MIN(lat) FROM lats WHERE i > n / 100) AS min_lat,
+            (SELECT MIN(lon) FROM lons WHERE i > n / 100) AS min_lon,
+            (SELECT MAX(lat) FROM lats WHERE i <= n - n / 100) AS max_lat,
+            (SELECT MAX(lon) FROM lons WHERE i <= n - n / 100) AS max_lon
+        """,
+        params=(uf,),
+        formatted=False
+    )[0]
+
+@st.cache_data
+def load_data(lat, lon, zoom, limit):
+    # somente os pontos da area visivel, via indice espacial
+    pontos = db.bbox(*viewport(lat, lon, zoom))
+    return (
+        pontos.groupby(["lat", "lon"]).size().reset_index(name="qntd")
+        .sort_values("qntd", ascending=False)
+        .head(limit)
     )
 
+def legenda(df):
+    fracao = df.attrs["fracao"]
+    if fracao < 1:
+        st.caption(f"Estimado com amostra de {fracao:.0%} dos acidentes (IC de 95%)")
+    else:
+        st.caption("Valor exato: as amostras não atingiram o erro pedido")
+
+def exportar(nome, query, params=(), descricao=None):
+    # gera o arquivo sob demanda, em lotes, num temporario apagado logo que o
+    # botao de download recebe seu conteudo
+    with st.expander("Exportar resultado"):
+        if descricao:
+            st.caption(descricao)
+        formato = st.radio("Formato", ["csv", "parquet"], horizontal=True, key=f"{nome}_formato")
+        extensao = "csv.gz" if formato == "csv" else "parquet"
+
+        if st.button("Gerar arquivo", key=f"{nome}_gerar"):
+            with tempfile.NamedTemporaryFile(suffix=f".{extensao}") as arquivo:
+                stats = db.export(query, arquivo.name, formato, params)
+                st.caption(
+                    f"{stats['linhas']:,} linhas em {stats['segundos']:.2f}s "
+                    f"({stats['linhas_por_segundo']:,.0f} linhas/s)"
+                )
+                st.download_button(
+                    "Baixar", arquivo.read(), file_name=f"{nome}.{extensao}", key=f"{nome}_baixar", on_click="ignore"
+                )
+
+def tabela(nome, query, params=()):
+    st.dataframe(db.fetch(query, params=params))
+    exportar(nome, query, params)
+
+def rotulo(dimensao):
+    # valor com sua contagem no catalogo, ex.: "MG (12,345)"
+    linhas = dict(db.domain(dimensao).itertuples(index=False))
+    return lambda valor: f"{valor} ({linhas[valor]:,})"
+
 def update_query_params():
     limit_selected = st.session_state["limit"]
     st.query_params["limit"] = limit_selected
@@ -81,7 +199,7 @@ if not st.session_state.get("url_synced", False):
     except KeyError:
         pass
 
-estados = db.fetch("SELECT DISTINCT UF FROM Municipio")["UF"].to_list()
+estados = db.domain("estado")["Valor"].to_list()
 
 limit = st.slider(
         "Selecione a quantidade de acidentes", 1000, 10000, key="limit", on_change=update_query_params
@@ -90,36 +208,39 @@ limit = st.slider(
 uf = st.radio(
     "Selecione um Estado",
     estados,
+    format_func=rotulo("estado"),
     horizontal=True,
     key="uf_map"
 )
 
-data = load_data(uf, limit)
+janela = extensao_uf(uf)
+if None in janela:
+    st.info("Nenhum acidente com coordenadas neste estado")
+else:
+    # o mapa enquadra o estado inteiro; os hexagonos crescem quando o zoom diminui
+    lat, lon, zoom = enquadrar(*janela)
+    escala = 2 ** (10 - zoom)
+    data = load_data(lat, lon, zoom, limit)
 
-data["qntd"] = data["qntd"].astype(int)
-data["lat"] = pd.to_numeric(data["lat"].astype(str).str.replace(",", "."))
-data["lon"] = pd.to_numeric(data["lon"].astype(str).str.replace(",", "."))
-
-map(data, data["lat"].head().median(), data["lon"].head().median(), 10, 100, 2, [2000, 8000], [
-        [255,255,178],
-        [254,217,118],
-        [254,178,76],
-        [253,141,60],
-        [240,59,32],
-        [189,0,38],
-    ])
+    map(data, lat, lon, zoom, 100 * escala, 2 * escala, [2000, 8000], [
+            [255,255,178],
+            [254,217,118],
+            [254,178,76],
+            [253,141,60],
+            [240,59,32],
+            [189,0,38],
+        ])
 
 # Consulta 1
 st.markdown("## Quantidade de veículos por tipo envolvidos em acidentes")
-st.dataframe(
-    db.fetch(
-        """SELECT tipo, COUNT(*) AS quantidade
-         FROM Veiculo
-         WHERE tipo != "Outros"
-         GROUP BY tipo
-         ORDER BY quantidade DESC
-         """
-    )
+tabela(
+    "consulta1",
+    """SELECT tipo, COUNT(*) AS quantidade
+     FROM Veiculo
+     WHERE tipo != "Outros"
+     GROUP BY tipo
+     ORDER BY quantidade DESC
+     """
 )
 
 # Consulta 2
@@ -127,55 +248,74 @@ st.markdown("## Todos os municípios do Estado que já houve acidente")
 uf2 = st.radio(
     "Selecione um Estado",
     estados,
+    format_func=rotulo("estado"),
     horizontal=True,
     key="consulta2"
 )
-st.dataframe(
-    db.fetch(
-        f"""SELECT Nome
+busca_municipio = st.text_input("Buscar município", key="busca_consulta2")
+if busca_municipio:
+    st.dataframe(
+        db.search(busca_municipio, "municipio", uf2, limit=50)[["Valor"]].rename(columns={"Valor": "Nome"})
+    )
+else:
+    tabela(
+        "consulta2",
+        """SELECT Nome
          FROM Municipio
-         WHERE UF = '{uf2}'
+         WHERE UF = ?
          ORDER BY Nome ASC
-         """
+         """,
+        params=(uf2,)
     )
+
+# Busca
+st.markdown("## Busca de causas e marcas de veículos")
+tipo_busca = st.radio(
+    "Buscar em",
+    ["causa", "marca"],
+    format_func={"causa": "Causas", "marca": "Marcas de veículos"}.get,
+    horizontal=True,
+    key="tipo_busca"
 )
+termo = st.text_input("Termo", key="termo_busca")
+if termo:
+    st.dataframe(db.search(termo, tipo_busca, limit=50)[["Valor"]])
 
 # Consulta 3
 st.markdown("## Quais condições climáticas mais ocorrem acidentes")
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT C.Descricao as Condicao_Climatica,
-        COUNT(A.ID) as Total_Acidentes
-        FROM Acidente as A
-        JOIN Condicao_climatica as C ON A.CID=C.ID
-        GROUP BY C.Descricao
-        ORDER BY Total_Acidentes DESC
-         """
-    )
+tabela(
+    "consulta3",
+    f"""
+    SELECT C.Descricao as Condicao_Climatica,
+    COUNT(A.ID) as Total_Acidentes
+    FROM Acidente as A
+    JOIN Condicao_climatica as C ON A.CID=C.ID
+    GROUP BY C.Descricao
+    ORDER BY Total_Acidentes DESC
+     """
 )
 
 # Consulta 4
 st.markdown("## Quais os 10 km's de uma BR que mais ocorrem acidentes")
-brs = db.fetch("SELECT DISTINCT Br FROM Trecho WHERE Br IS NOT NULL")["Br"].to_list()
+brs = db.domain("br")["Valor"].to_list()
 br = st.radio(
     "Selecione uma Br",
     brs,
+    format_func=rotulo("br"),
     horizontal=True,
     key="consulta4"
 )
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT CAST(Trecho.km AS INTEGER) AS KM_Trecho, COUNT(*) AS Quantidade
-        FROM Trecho
-        JOIN Acidente ON Trecho.ID = Acidente.TID
-        WHERE Trecho.br = {br}
-        GROUP BY KM_Trecho
-        ORDER BY Quantidade DESC
-        LIMIT 10
-         """
-    )
+tabela(
+    "consulta4",
+    f"""
+    SELECT CAST(Trecho.km AS INTEGER) AS KM_Trecho, COUNT(*) AS Quantidade
+    FROM Trecho
+    JOIN Acidente ON Trecho.ID = Acidente.TID
+    WHERE Trecho.br = {br}
+    GROUP BY KM_Trecho
+    ORDER BY Quantidade DESC
+    LIMIT 10
+     """
 )
 
 # Consulta 5
@@ -186,145 +326,180 @@ data = st.date_input(
     max_value=datetime.date(2024, 12, 31),
     format="DD/MM/YYYY"
 )
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT Delegacia.ID, COUNT(*) AS Quantidade
-        FROM Delegacia
-        JOIN Acidente ac 
-            ON Delegacia.ID = ac.DID
-        WHERE ac.data > '{data}'
-        GROUP BY Delegacia.ID
-        ORDER BY Quantidade DESC
-        LIMIT 10
-         """
-    )
+tabela(
+    "consulta5",
+    """
+    SELECT DID AS ID, SUM(Total) AS Quantidade
+    FROM Rollup_delegacia
+    WHERE Dia > ?
+    GROUP BY DID
+    ORDER BY Quantidade DESC
+    LIMIT 10
+     """,
+    params=(chave_dia(data),)
 )
 
 # Consulta 6
 st.markdown("## Probabilidades de acidentes com classificação escolhida ocorrerem em condições específicas")
-todas_class = db.fetch("SELECT DISTINCT Classificacao FROM Acidente")["Classificacao"].to_list()
+todas_class = db.domain("classificacao")["Valor"].to_list()
 classificacao = st.radio(
     "Escolha uma classificação",
     todas_class,
+    format_func=rotulo("classificacao"),
     key="consulta5"
 )
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT
-        ac.Classificacao,
-        cc.Descricao,
-        cc.Fase_dia,
-        tv.Tipo AS Tipo_trecho,
-        ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM Acidente), 3) AS Probabilidade
-        FROM
-        Acidente ac
-        LEFT JOIN Condicao_climatica cc
-        ON ac.CID = cc.ID
-        LEFT JOIN Trecho t
-        ON ac.TID = t.ID
-        LEFT JOIN Tracado_via tv
-        ON tv.TID = t.ID
-        WHERE
-        tv.Tipo IS NOT NULL
-        AND ac.Classificacao = '{classificacao}'
-        GROUP BY
-        ac.Classificacao,
-        cc.Fase_dia,
-        tv.Tipo,
-        cc.Descricao
-        ORDER BY
-        Probabilidade DESC;
-         """
-    )
+fatos_classificacao = f"""
+    SELECT
+    ac.ID AS AID,
+    ac.Classificacao,
+    cc.Descricao,
+    cc.Fase_dia,
+    tv.Tipo AS Tipo_trecho
+    FROM
+    {{Acidente}} ac
+    LEFT JOIN Condicao_climatica cc
+    ON ac.CID = cc.ID
+    LEFT JOIN Trecho t
+    ON ac.TID = t.ID
+    LEFT JOIN Tracado_via tv
+    ON tv.TID = t.ID
+    WHERE
+    tv.Tipo IS NOT NULL
+    AND ac.Classificacao = '{classificacao}'
+    """
+grupos_classificacao = ["Classificacao", "Descricao", "Fase_dia", "Tipo_trecho"]
+probabilidades = db.approx(fatos_classificacao, grupos_classificacao, exact=not aproximado, error=erro_max)
+total_acidentes = db.fetch("SELECT SUM(Total) AS total FROM Estrato")["total"][0]
+for coluna, nova in [("Estimativa", "Probabilidade"), ("IC_inf", "Prob_IC_inf"), ("IC_sup", "Prob_IC_sup")]:
+    probabilidades[nova] = (probabilidades.pop(coluna) * 100.0 / total_acidentes).round(3)
+if aproximado:
+    legenda(probabilidades)
+else:
+    probabilidades = probabilidades.drop(columns=["Prob_IC_inf", "Prob_IC_sup"])
+st.dataframe(probabilidades)
+exportar(
+    "consulta6",
+    f"""
+    SELECT Classificacao, Descricao, Fase_dia, Tipo_trecho,
+    ROUND(Estimativa * 100.0 / (SELECT SUM(Total) FROM Estrato), 3) AS Probabilidade
+    FROM ({db.exact_query(fatos_classificacao, grupos_classificacao)})
+    ORDER BY Probabilidade DESC
+    """,
+    descricao="Probabilidades exatas, mesmo no modo aproximado" if aproximado else None
 )
 
 # Consulta 7
 st.markdown("## Quais são os horários e fazes do dia que mais ocorreram acidentes com estado físico escolhido")
-estados_fis = db.fetch("SELECT DISTINCT Estado_fisico FROM Envolveu_vitima")["Estado_fisico"].to_list()
+estados_fis = db.domain("estado_fisico")["Valor"].to_list()
 estado_fis = st.radio(
     "Escolha um estado físico",
     estados_fis,
+    format_func=rotulo("estado_fisico"),
     key="consulta6"
 )
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT Acidente.Horario, Condicao_climatica.Fase_dia, COUNT(*) AS Total_Estado
-        FROM Acidente
-        JOIN Envolveu_vitima ON Acidente.ID = Envolveu_vitima.AID
-        JOIN Condicao_climatica ON Acidente.CID = Condicao_climatica.ID
-        WHERE Envolveu_vitima.Estado_fisico = '{estado_fis}'
-        GROUP BY Acidente.Horario, Condicao_climatica.Fase_dia
-        ORDER BY Total_Estado DESC LIMIT 10;
-         """
-    )
+tabela(
+    "consulta7",
+    """
+    SELECT printf('%02d:00', r.Hora) AS Horario, cc.Fase_dia, SUM(r.Total) AS Total_Estado
+    FROM Rollup_estado_fisico r
+    JOIN Condicao_climatica cc ON r.CID = cc.ID
+    WHERE r.Estado_fisico = ?
+    GROUP BY r.Hora, cc.Fase_dia
+    ORDER BY Total_Estado DESC LIMIT 10
+     """,
+    params=(estado_fis,)
+)
+
+# Tendencia
+st.markdown("## Evolução semanal dos acidentes por classificação")
+tendencia = db.fetch(
+    """
+    SELECT Dia, Classificacao, SUM(Total) AS Total
+    FROM Rollup_classificacao
+    GROUP BY Dia, Classificacao
+    """
+)
+tendencia["Dia"] = pd.to_datetime(tendencia["Dia"].astype(str), format="%Y%m%d")
+st.line_chart(
+    tendencia.pivot_table(index="Dia", columns="Classificacao", values="Total", aggfunc="sum")
+    .resample("W").sum()
 )
 
 # Consulta 8
 st.markdown("## Quais modelos de veículo sofrem mais acidentes em dias chuvosos")
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT Veiculo.Marca, COUNT(*) AS Total_Acidentes
-        FROM Veiculo
-        JOIN Envolveu_veiculo ON Veiculo.ID = Envolveu_veiculo.VID
-        JOIN Acidente ON Envolveu_veiculo.AID = Acidente.ID
-        JOIN Condicao_climatica ON Acidente.CID = Condicao_climatica.ID
-        WHERE Condicao_climatica.Descricao = 'Chuva'
-        GROUP BY Veiculo.Marca
-        ORDER BY Total_Acidentes DESC LIMIT 6
-         """
-    )
+tabela(
+    "consulta8",
+    f"""
+    SELECT Veiculo.Marca, COUNT(*) AS Total_Acidentes
+    FROM Veiculo
+    JOIN Envolveu_veiculo ON Veiculo.ID = Envolveu_veiculo.VID
+    JOIN Acidente ON Envolveu_veiculo.AID = Acidente.ID
+    JOIN Condicao_climatica ON Acidente.CID = Condicao_climatica.ID
+    WHERE Condicao_climatica.Descricao = 'Chuva'
+    GROUP BY Veiculo.Marca
+    ORDER BY Total_Acidentes DESC LIMIT 6
+     """
 )
 
 # Consulta 9
 st.markdown("## Quais causas são as mais comuns por estado")
+fatos_causa = """
+    SELECT
+        A.ID AS AID,
+        M.UF as Estado,
+        C.Descricao as Causa
+    FROM {Acidente} as A
+    JOIN Tem_causa as TC ON A.ID=TC.AID
+    JOIN Causa as C ON TC.CID=C.ID
+    JOIN Trecho as T ON A.TID=T.ID
+    JOIN Municipio as M ON T.MID=M.ID
+    """
+causas = db.approx(fatos_causa, ["Estado", "Causa"], exact=not aproximado, error=erro_max, top=["Estado"])
+if aproximado:
+    legenda(causas)
+else:
+    causas = causas.drop(columns=["IC_inf", "IC_sup"])
+# causa mais comum por estado (a ordem ja e decrescente)
 st.dataframe(
-    db.fetch(
-        f"""
-        SELECT Estado, Causa, Total_Acidentes
-        FROM(
-            SELECT 
-                M.UF as Estado, 
-                C.Descricao as Causa, 
-                COUNT(*) as Total_Acidentes, 
-                ROW_NUMBER()OVER(PARTITION BY M.UF ORDER BY COUNT(*) DESC) as rn
-            FROM Acidente as A
-            JOIN Tem_causa as TC ON A.ID=TC.AID
-            JOIN Causa as C ON TC.CID=C.ID
-            JOIN Trecho as T ON A.TID=T.ID
-            JOIN Municipio as M ON T.MID=M.ID
-            GROUP BY M.UF, C.Descricao
-        )subquery
-        WHERE rn = 1
-        ORDER BY Estado ASC
-         """
+    causas.rename(columns={"Estimativa": "Total_Acidentes"})
+    .groupby("Estado").head(1)
+    .sort_values("Estado")
+    .reset_index(drop=True)
+)
+exportar(
+    "consulta9",
+    f"""
+    SELECT Estado, Causa, Total_Acidentes
+    FROM (
+        SELECT Estado, Causa, Estimativa AS Total_Acidentes,
+        ROW_NUMBER() OVER (PARTITION BY Estado ORDER BY Estimativa DESC) AS rn
+        FROM ({db.exact_query(fatos_causa, ["Estado", "Causa"])})
     )
+    WHERE rn = 1
+    ORDER BY Estado ASC
+    """,
+    descricao="Totais exatos, mesmo no modo aproximado" if aproximado else None
 )
 
 # Consulta 10
 st.markdown("## Quais são as rodovias mais perigosas - mais acidentes fatais")
-st.dataframe(
-    db.fetch(
-        f"""
-        SELECT Br, COUNT(*) as Mortes
-        FROM Acidente ac
-        LEFT JOIN Envolveu_vitima ev
-            ON ev.AID = ac.ID
-        LEFT JOIN Trecho t
-            ON t.ID = ac.TID
-        WHERE Estado_fisico = 'Óbito'
-        GROUP BY Br
-        ORDER BY COUNT(*) DESC
-        LIMIT 10;
-        """
-    )
+tabela(
+    "consulta10",
+    f"""
+    SELECT Br, COUNT(*) as Mortes
+    FROM Acidente ac
+    LEFT JOIN Envolveu_vitima ev
+        ON ev.AID = ac.ID
+    LEFT JOIN Trecho t
+        ON t.ID = ac.TID
+    WHERE Estado_fisico = 'Óbito'
+    GROUP BY Br
+    ORDER BY COUNT(*) DESC
+    LIMIT 10
+    """
 )
 
-coordenadas_br = db.fetch(
-    """
+consulta_coordenadas = """
     SELECT
         COUNT(*) as qntd,
         Latitude as lat,
@@ -345,7 +520,7 @@ coordenadas_br = db.fetch(
     )
     GROUP BY Latitude, Longitude
     """
-)
+coordenadas_br = db.fetch(consulta_coordenadas)
 
 coordenadas_br["qntd"] = coordenadas_br["qntd"].astype(int)
 coordenadas_br["lat"] = pd.to_numeric(coordenadas_br["lat"].astype(str).str.replace(",", "."))
@@ -362,5 +537,7 @@ map(coordenadas_br, coordenadas_br["lat"].head().median(), coordenadas_br["lon"]
     ], 60, 0.35
     ) 
 # plotar o mapa indicando todas as coordenadas da tabela acidentes
+exportar("coordenadas_br", consulta_coordenadas)
+
 
 
@@ -1,32 +1,93 @@
 import os
 import csv
+import gzip
+import math
+import re
+import difflib
+import unicodedata
 import zipfile
 import sqlite3
+import time
 import requests
 import pandas as pd
 import seaborn as sns
 from io import BytesIO
 import matplotlib.pyplot as plt
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
+from pipeline import Pipeline, Rejeitada, aparar, nulos, inteiro, decimal, mapear, maximo, obrigatorias
+
+
+RAIO_TERRA_KM = 6371.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distância em km entre dois pontos (lat/lon em graus).
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * math.asin(math.sqrt(a))
+
+
+def normalizar(texto):
+    """
+    Minúsculas e sem acentos, como o tokenizador do indice de busca.
+    """
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def chave_dia(data):
+    """
+    Chave inteira AAAAMMDD de uma data (como em Acidente.Dia).
+    """
+    return data.year * 10000 + data.month * 100 + data.day
 
 
 class Database:
     complete = False
     nome_zip = "acidentes2024.zip"
     nome_csv = "acidentes2024_todas_causas_tipos.csv"
+    nome_rejeitadas = "acidentes2024_rejeitadas.csv"
     db_name = 'acidentes2024.db'
+
+    # amostras estratificadas (modo aproximado): fracoes aninhadas por nivel
+    # e tamanho minimo de cada estrato
+    fracoes_amostra = (0.01, 0.05, 0.2)
+    min_estrato = 30
+
+    # dominios do catalogo ja lidos, por (db_name, dimensao); compartilhado
+    # entre instancias porque o app cria um Database a cada execucao
+    _dominios = {}
+
+    # tempo da ultima contagem exata de cada consulta de approx()
+    _custos_exatos = {}
     
-    def __init__(self):
+    def __init__(self, db_name=None, progress=None):
+        if db_name is not None:
+            self.db_name = db_name
+
+        # progress(fase, **dados) recebe o andamento da ingestao
+        self.progress = progress
+
         if not os.path.isfile(self.db_name):
             open(self.db_name, "w").close()
             os.chmod(self.db_name, 0o666)            
         
         self.conn = sqlite3.connect(self.db_name)
+        self._tamanhos = {}
 
-    def fetch(self, query, formatted=True):
+    def _report(self, fase, **dados):
+        if self.progress is not None:
+            self.progress(fase, **dados)
+
+
+    def fetch(self, query, formatted=True, params=()):
         # execute the query and fetch all rows
         cur = self.conn.cursor()
-        cur.execute(query)
+        cur.execute(query, params)
         rs = cur.fetchall()
 
         # extract column names from the cursor description
@@ -36,6 +97,83 @@ class Database:
         return pd.DataFrame(rs, columns=columns) if formatted else rs
 
 
+    def export(self, query, path, fmt='csv', params=(), batch_size=10000):
+        """
+        Grava o resultado da consulta em `path` (CSV gzip ou Parquet) em lotes
+        do cursor, sem montar o resultado inteiro em memoria.
+
+        Em Parquet a consulta roda duas vezes: uma passada agregada descobre o
+        tipo de cada coluna antes do primeiro lote, o que dobra o custo de
+        consultas pesadas (como as contagens exatas).
+        """
+        inicio = time.perf_counter()
+        # a consulta e embutida como subconsulta no Parquet
+        query = query.strip().rstrip(';')
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        columns = [desc[0] for desc in cur.description]
+        linhas = 0
+
+        if fmt == 'csv':
+            with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                while batch := cur.fetchmany(batch_size):
+                    writer.writerows(batch)
+                    linhas += len(batch)
+
+        elif fmt == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("exportar em Parquet requer o pacote pyarrow")
+
+            # o tipo de cada coluna vem dos tipos de armazenamento (typeof) de
+            # todo o resultado: inteiros e reais viram double, misturas com
+            # texto viram texto, assim nenhum lote e convertido com perda
+            schema, conversoes = self._parquet_schema(query, params, columns, pa)
+            with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+                while batch := cur.fetchmany(batch_size):
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array([None if v is None else converter(v) for v in col], type=field.type)
+                         for col, field, converter in zip(zip(*batch), schema, conversoes)],
+                        schema=schema
+                    ))
+                    linhas += len(batch)
+
+        else:
+            raise ValueError(f"formato de exportacao desconhecido: {fmt}")
+
+        segundos = time.perf_counter() - inicio
+        return {'linhas': linhas, 'segundos': segundos, 'linhas_por_segundo': linhas / segundos if segundos else 0.0}
+
+
+    def _parquet_schema(self, query, params, columns, pa):
+        # uma passada agregada (sem materializar linhas) pelos tipos de cada coluna
+        tipos = ('integer', 'real', 'text', 'blob')
+        contagens = ', '.join(
+            f"MAX(typeof(q.\"{c}\") = '{t}')" for c in columns for t in tipos
+        )
+        presentes = self.fetch(f'SELECT {contagens} FROM ({query}) q', False, params)[0]
+
+        campos, conversoes = [], []
+        for i, column in enumerate(columns):
+            achados = {t for t, presente in zip(tipos, presentes[i * 4:(i + 1) * 4]) if presente}
+            if achados == {'integer'}:
+                tipo, conversao = pa.int64(), int
+            elif achados and achados <= {'integer', 'real'}:
+                tipo, conversao = pa.float64(), float
+            elif achados == {'blob'}:
+                tipo, conversao = pa.binary(), bytes
+            else:
+                tipo, conversao = pa.string(), str
+            campos.append((column, tipo))
+            conversoes.append(conversao)
+
+        return pa.schema(campos), conversoes
+
+
     def show_tables(self):
         return [x[0] for x in self.fetch('SELECT tbl_name FROM sqlite_master WHERE type="table"', False)]
 
@@ -78,38 +216,306 @@ class Database:
         return df1.merge(df2, left_on='name', right_index=True) \
                 .merge(df3, left_on='name', right_index=True) \
                 .merge(df4, left_on='name', right_index=True)
-        
+
+
+    def domain(self, name):
+        # valores da dimensao e suas contagens; lido do banco uma unica vez
+        chave = (os.path.abspath(self.db_name), name)
+        if chave not in self._dominios:
+            df = self.fetch("""
+            SELECT Valor, Linhas
+            FROM Dominio
+            WHERE Dimensao = ?
+            ORDER BY Valor IS NULL, Valor
+            """, params=(name,))
+            if df.empty:
+                raise KeyError(f"dimensao desconhecida: {name}")
+
+            # NULL continua None (e nao NaN) para servir de opcao em widgets
+            df['Valor'] = df['Valor'].astype(object).where(df['Valor'].notna(), None)
+            self._dominios[chave] = df
+
+        return self._dominios[chave]
+
+
+    def catalog(self):
+        return self.fetch('SELECT Dimensao, Cardinalidade, Linhas FROM Catalogo ORDER BY Dimensao')
+
+
+    def search(self, termo, tipo=None, contexto=None, limit=20, fuzzy=True):
+        # cada palavra do termo vira um prefixo: "sao pa" -> "sao"* "pa"*
+        palavras = re.findall(r'\w+', termo)
+        columns = ['Tipo', 'Valor', 'Contexto', 'ID']
+        if not palavras:
+            return pd.DataFrame([], columns=columns)
+
+        filtros, params = '', (' '.join(f'"{p}"*' for p in palavras),)
+        if tipo is not None:
+            filtros += ' AND Tipo = ?'
+            params += (tipo,)
+        if contexto is not None:
+            filtros += ' AND Contexto = ?'
+            params += (contexto,)
+
+        df = self.fetch(f"""
+        SELECT Tipo, Valor, Contexto, RefID AS ID
+        FROM Busca
+        WHERE Busca MATCH ?{filtros}
+        ORDER BY rank
+        LIMIT ?
+        """, params=params + (limit,))
+
+        if len(df) or not fuzzy:
+            return df
+
+        # nenhum prefixo casou: aproxima cada palavra do termo pela palavra mais
+        # parecida do valor (erros de digitacao); todas precisam ter similaridade
+        candidatos = self.fetch(f"SELECT Tipo, Valor, Contexto, RefID AS ID FROM Busca WHERE 1{filtros}",
+                                params=params[1:])
+        palavras = [normalizar(p) for p in palavras]
+
+        def nota(valor):
+            tokens = re.findall(r'\w+', normalizar(valor))
+            return min(max((difflib.SequenceMatcher(None, p, t).ratio() for t in tokens), default=0.0)
+                       for p in palavras)
+
+        notas = candidatos['Valor'].map(nota)
+
+        return candidatos.assign(_nota=notas)[notas >= 0.6].sort_values('_nota', ascending=False) \
+                .drop(columns='_nota').head(limit).reset_index(drop=True)
+
+
+    def approx(self, query, by, exact=False, error=None, latency=None, confidence=0.95, top=None):
+        """
+        Contagens agrupadas por `by`, exatas ou estimadas a partir da amostra.
+
+        `query` usa {Acidente} no lugar da tabela Acidente e devolve uma linha
+        por fato contado, com o ID do acidente em AID e as colunas de `by`.
+        `error` e o erro relativo maximo (meia largura do intervalo) aceito
+        nos grupos exibidos: o maior grupo de cada valor das colunas `top`,
+        quando dadas, ou os grupos com ao menos 1% do total; `latency`, o
+        tempo maximo em segundos. Sem nenhum dos dois, usa a menor amostra.
+        """
+        if exact:
+            return self._exato(query, by)
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        # fracao efetiva de cada nivel (o minimo por estrato a torna maior
+        # que a nominal nos estratos pequenos)
+        fracoes = [self._fracao_amostra(nivel) for nivel in range(len(self.fracoes_amostra))]
+
+        nivel = 0
+        while True:
+            inicio = time.perf_counter()
+            df = self._estimar(query, by, nivel, z)
+            gasto = time.perf_counter() - inicio
+
+            # custo de um nivel previsto pelo tempo deste; o do modo exato e o
+            # medido na ultima execucao exata da consulta, se houver
+            def custo(fracao):
+                return gasto * fracao / fracoes[nivel]
+            custo_exato = self._custos_exatos.get(self._chave(query, by), custo(1.0))
+
+            if error is not None:
+                erro = self._erro_relativo(df, top)
+                if erro <= error:
+                    return df
+
+                # o erro cai com a raiz do tamanho da amostra: pula direto para
+                # o menor nivel que deve atingi-lo
+                necessaria = fracoes[nivel] * (erro / error) ** 2
+                alvo = next((i for i in range(nivel + 1, len(fracoes)) if fracoes[i] >= necessaria), None)
+            elif latency is not None and custo_exato > latency:
+                # so latencia: o maior nivel que cabe no tempo
+                alvo = next((i for i in reversed(range(nivel + 1, len(fracoes))) if custo(fracoes[i]) <= latency), None)
+                if alvo is None:
+                    return df
+            else:
+                if latency is None:
+                    return df
+                alvo = None
+
+            # nenhuma amostra serve, ou a proxima custaria tanto quanto a exata
+            if alvo is None or custo(fracoes[alvo]) >= custo_exato:
+                if latency is not None and custo_exato > latency:
+                    return df
+                return self._exato(query, by)
+
+            if latency is not None and custo(fracoes[alvo]) > latency:
+                return df
+            nivel = alvo
+
+
+    def exact_query(self, query, by):
+        # SQL da contagem exata feita por approx(..., exact=True)
+        colunas = ', '.join(f'"{c}"' for c in by)
+        return f"""
+        SELECT {colunas}, COUNT(*) AS Estimativa
+        FROM ({query.replace('{Acidente}', 'Acidente')})
+        GROUP BY {colunas}
+        ORDER BY Estimativa DESC
+        """
+
+
+    def _chave(self, query, by):
+        return (os.path.abspath(self.db_name), query, tuple(by))
+
+
+    def _exato(self, query, by):
+        inicio = time.perf_counter()
+        df = self.fetch(self.exact_query(query, by))
+        self._custos_exatos[self._chave(query, by)] = time.perf_counter() - inicio
+        df['IC_inf'] = df['IC_sup'] = df['Estimativa']
+        df.attrs['fracao'] = 1.0
+
+        return df
+
+
+    def _estimar(self, query, by, nivel, z):
+        amostra = f'(SELECT a.* FROM Amostra s JOIN Acidente a ON a.ID = s.AID WHERE s.Nivel <= {nivel})'
+        colunas = ', '.join(f'"{c}"' for c in by)
+
+        # y: fatos por acidente amostrado; Y e Q: soma e soma dos quadrados por
+        # grupo e estrato, agregados no SQLite
+        h = self.fetch(f"""
+        SELECT {colunas}, Estrato, SUM(y) AS Y, SUM(y * y) AS Q
+        FROM (
+            SELECT {', '.join(f'q."{c}"' for c in by)}, s.Estrato, COUNT(*) AS y
+            FROM ({query.replace('{Acidente}', amostra)}) q
+            JOIN Amostra s
+            ON s.AID = q.AID
+            GROUP BY {', '.join(f'q."{c}"' for c in by)}, s.Estrato, q.AID
+        )
+        GROUP BY {colunas}, Estrato
+        """)
+        h = h.merge(self._tamanho_amostra(nivel), on='Estrato')
+
+        # estimador de Horvitz-Thompson estratificado e sua variancia
+        s2 = ((h['Q'] - h['Y'] ** 2 / h['n']) / (h['n'] - 1)).where(h['n'] > 1, 0)
+        h['Estimativa'] = h['N'] / h['n'] * h['Y']
+        h['Var'] = h['N'] ** 2 * (1 - h['n'] / h['N']) * s2 / h['n']
+
+        df = h.groupby(by, dropna=False)[['Estimativa', 'Var']].sum().reset_index()
+        meia = z * df.pop('Var') ** 0.5
+        df['IC_inf'] = (df['Estimativa'] - meia).clip(lower=0)
+        df['IC_sup'] = df['Estimativa'] + meia
+        df = df.sort_values('Estimativa', ascending=False).reset_index(drop=True)
+        df.attrs['fracao'] = self._fracao_amostra(nivel)
+
+        return df
+
+
+    def _tamanho_amostra(self, nivel):
+        # N e n de cada estrato no nivel, guardados apos a primeira consulta
+        if nivel not in self._tamanhos:
+            self._tamanhos[nivel] = self.fetch("""
+            SELECT s.Estrato, e.Total AS N, COUNT(*) AS n
+            FROM Amostra s
+            JOIN Estrato e
+            ON e.Nome = s.Estrato
+            WHERE s.Nivel <= ?
+            GROUP BY s.Estrato
+            """, params=(nivel,))
+
+        return self._tamanhos[nivel]
+
+
+    def _fracao_amostra(self, nivel):
+        tamanho = self._tamanho_amostra(nivel)
+        return tamanho['n'].sum() / tamanho['N'].sum()
+
+
+    @staticmethod
+    def _erro_relativo(df, top=None):
+        # df vem em ordem decrescente de estimativa
+        if top is not None:
+            grandes = df.groupby(top, dropna=False).head(1)
+        else:
+            grandes = df[df['Estimativa'] >= 0.01 * df['Estimativa'].sum()]
+        if grandes.empty:
+            return 0.0
+
+        return ((grandes['IC_sup'] - grandes['Estimativa']) / grandes['Estimativa']).max()
+
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, limit=None):
+        # acidentes dentro da janela, via indice espacial
+        query = """
+        SELECT ID, min_lat AS lat, min_lon AS lon
+        FROM Acidente_geo
+        WHERE min_lat >= ? AND max_lat <= ?
+        AND min_lon >= ? AND max_lon <= ?
+        """
+        params = (min_lat, max_lat, min_lon, max_lon)
+
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+
+        return self.fetch(query, params=params)
+
+
+    def radius(self, lat, lon, km):
+        # janela que contem o circulo; o filtro exato e feito com haversine
+        dlat = math.degrees(km / RAIO_TERRA_KM)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        rows = self.bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon).itertuples(index=False)
+
+        dentro = [(r.ID, r.lat, r.lon, haversine(lat, lon, r.lat, r.lon)) for r in rows]
+        dentro = sorted([r for r in dentro if r[3] <= km], key=lambda r: r[3])
+
+        return pd.DataFrame(dentro, columns=['ID', 'lat', 'lon', 'dist_km'])
+
+
+    def nearest(self, lat, lon, k=50, km=1.0):
+        # dobra o raio ate conter k acidentes (ou cobrir o globo)
+        while True:
+            df = self.radius(lat, lon, km)
+            if len(df) >= k or km >= math.pi * RAIO_TERRA_KM:
+                return df.head(k)
+            km *= 2
+
 
     def download_and_extract(self):
         if not os.path.isfile(self.nome_zip):
             url = "https://drive.usercontent.google.com/u/0/uc?id=14qBOhrE1gioVtuXgxkCJ9kCA8YtUGXKA&export=download"
             response = requests.get(url, stream=True)
+            total = int(response.headers.get("Content-Length", 0)) or None
+            baixados = 0
 
-            with open(self.nome_zip, "wb") as fileZip:
+            # baixa para um arquivo temporario para nao deixar um zip pela metade
+            with open(self.nome_zip + ".part", "wb") as fileZip:
                 for chunk in response.iter_content(chunk_size=262144):
                     fileZip.write(chunk)
+                    baixados += len(chunk)
+                    self._report('download', bytes=baixados, total=total)
+
+            os.replace(self.nome_zip + ".part", self.nome_zip)
 
         if not os.path.isfile(self.nome_csv):
             # Abrindo e extraindo o arquivo ZIP
+            self._report('extracao')
             with zipfile.ZipFile(self.nome_zip, 'r') as zip_ref:
                 zip_ref.extractall("./")
         
         try:
-            if 'Acidente' in self.show_tables():
-                self.complete = True
-            else:
+            tabelas = self.show_tables()
+            if 'Checkpoint' in tabelas:
+                # build concluido, ou interrompido e retomado a partir dos checkpoints
+                self.complete = self._concluida('limpeza')
+            elif tabelas:
+                # reabre a conexao, senao ela continuaria no arquivo removido
+                self.conn.close()
                 os.remove(self.db_name)
                 open(self.db_name, "w").close()
                 os.chmod(self.db_name, 0o666)
+                self.conn = sqlite3.connect(self.db_name)
                 
         except Exception:
             pass
 
 
-    def create_db(self):
-        if self.complete:
-            return
-        
+    def _load_source(self):
         cur = self.conn.cursor()
 
         # Configurações PRAGMA para ingestão mais rápida
@@ -119,41 +525,65 @@ class Database:
         # Tamanho do lote
         BATCH_SIZE = 1000
 
-        # Função para limpar valores
-        def limpar_valores(linha):
-            """
-            Substitui valores específicos como 'NA' por None.
-            """
-            return [None if value in ("NA", "N/A", "", "NA/NA") else value.strip() for value in linha]
-
         # Começa a transação para inserção em massa
         cur.execute('BEGIN TRANSACTION')
 
+        # uma carga interrompida e refeita do inicio
+        cur.execute('DROP TABLE IF EXISTS Source')
+
         # Lê o arquivo CSV e insere os dados
         with open(self.nome_csv, 'r', encoding="latin-1") as f:
             reader = csv.reader(f, delimiter=';')  # Define o delimitador como ';'
             header = next(reader)  # Lê o cabeçalho
 
             # Cria a tabela dinamicamente
-            columns = [f'"{column.strip().replace(" ", "_")}"' for column in header]
+            nomes = [column.strip().replace(" ", "_") for column in header]
+            columns = [f'"{column}"' for column in nomes]
             create = f'CREATE TABLE IF NOT EXISTS Source ({", ".join(columns)})'
             cur.execute(create)
 
+            # Limpeza, tipos e validade aplicados enquanto o CSV e lido
+            transformar = Pipeline(
+                nomes,
+                aparar(),
+                nulos(),
+                inteiro('idade'),
+                decimal('km'),
+                mapear('causa_principal', {'Sim': 1, 'Não': 0}),
+                maximo('idade', 116),  # Pessoa mais velha do mundo tem 116 anos
+                obrigatorias('pesid', 'id_veiculo', 'tipo_envolvido'),
+            )
+
             # Prepara a instrução de inserção
             placeholders = ', '.join(['?'] * len(header))
             insert = f'INSERT INTO Source VALUES ({placeholders})'
 
-            # Processa as linhas em lotes
-            batch = []
-            for row in reader:
-                batch.append(limpar_valores(row))  # Limpa os valores na linha
-                if len(batch) == BATCH_SIZE:
+            # Linhas descartadas vao para um CSV com o motivo
+            with open(self.nome_rejeitadas, 'w', newline='', encoding='utf-8') as r:
+                rejeitadas = csv.writer(r, delimiter=';')
+                rejeitadas.writerow(header + ['motivo'])
+
+                # Processa as linhas em lotes
+                batch = []
+                linhas = descartadas = 0
+                for row in reader:
+                    try:
+                        batch.append(transformar(row))
+                    except Rejeitada as motivo:
+                        rejeitadas.writerow(row + [str(motivo)])
+                        descartadas += 1
+
+                    if len(batch) == BATCH_SIZE:
+                        cur.executemany(insert, batch)
+                        linhas += len(batch)
+                        batch = []
+                        self._report('carga', linhas=linhas, rejeitadas=descartadas)
+
+                # Insere quaisquer linhas restantes
+                if batch:
                     cur.executemany(insert, batch)
-                    batch = []
-
-            # Insere quaisquer linhas restantes
-            if batch:
-                cur.executemany(insert, batch)
+                    linhas += len(batch)
+                self._report('carga', linhas=linhas, rejeitadas=descartadas)
 
         # Commit das mudanças
         self.conn.commit()
@@ -162,20 +592,30 @@ class Database:
         cur.execute('PRAGMA synchronous = FULL')
         cur.execute('PRAGMA journal_mode = DELETE')
 
-        # Correcoes-----------------------------------------------
+        return linhas
 
-        # Definindo os tipos corretos
-        cur.execute('UPDATE Source SET idade = CAST(idade AS INTEGER) WHERE idade IS NOT NULL') # idade -> int
-        cur.execute("UPDATE Source SET km = CAST(REPLACE(km, ',', '.') AS REAL) WHERE km IS NOT NULL;") # km replace(',', '.') -> float
-        cur.execute("""UPDATE Source SET causa_principal = CASE
-                    WHEN causa_principal = 'Sim' THEN 1
-                    WHEN causa_principal = 'Não' THEN 0
-                    END;""") # convert causa_principal to boolean
 
+    def create_db(self):
+        if self.complete:
+            return
+        
+        cur = self.conn.cursor()
 
-        # Excluindo dados não-confiáveis
-        cur.execute('DELETE FROM Source WHERE idade IS NULL AND idade > 116') # excluir linhas com idade > 116 e Null (Pessoa mais velha do mundo tem 116 anos)
-        cur.execute('DELETE FROM Source WHERE pesid IS NULL OR id_veiculo IS NULL OR tipo_envolvido IS NULL') # excluir linhas com pesid, id_veiculo ou tipo_envolvido nulos
+        # checkpoints das etapas do build (permitem retomar um build interrompido)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS Checkpoint (
+            Etapa TEXT PRIMARY KEY,
+            Linhas INTEGER,
+            Segundos REAL,
+            Concluida TEXT
+        )
+        """)
+
+        if not self._concluida('Source'):
+            inicio = time.perf_counter()
+            linhas = self._load_source()
+            self._checkpoint('Source', linhas, time.perf_counter() - inicio)
+            self.conn.commit()
 
         # Criando tabelas------------------------------------------------
 
@@ -185,6 +625,8 @@ class Database:
             ID INTEGER PRIMARY KEY,
             Data DATE NOT NULL,
             Horario TIME NOT NULL,
+            Dia INTEGER,
+            Minuto INTEGER,
             Latitude REAL,
             Longitude REAL,
             Classificacao,
@@ -196,6 +638,8 @@ class Database:
             FOREIGN KEY (DID) REFERENCES Delegacia(ID)
         )
         """)
+        # consultas por intervalo de datas (e os agregados dia x hora)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_acidente_dia ON Acidente (Dia, Minuto)')
 
         # tabela Veiculo
         cur.execute("""
@@ -309,175 +753,519 @@ class Database:
         FOREIGN KEY (CID) REFERENCES Causa(ID)
         )
         """)
-        
-        self.conn.commit()
-
 
-    def populate_db(self):
-        if self.complete:
-            return
-        
-        cur = self.conn.cursor()
-        
-        # tabela causa
+        # indice espacial (R*Tree) das coordenadas dos acidentes
         cur.execute("""
-        INSERT INTO Causa (Descricao)
-        SELECT DISTINCT causa_acidente
-        FROM Source
-        WHERE causa_acidente IS NOT NULL
-        """)
-
-        # tabela veiculo
-        cur.execute("""
-        INSERT INTO Veiculo (ID, Tipo, Marca, Ano_fabricacao)
-        SELECT DISTINCT id_veiculo, tipo_veiculo, marca, ano_fabricacao_veiculo
-        FROM Source
-        WHERE id_veiculo IS NOT NULL
+        CREATE VIRTUAL TABLE IF NOT EXISTS Acidente_geo USING rtree(
+            ID,
+            min_lat, max_lat,
+            min_lon, max_lon
+        )
         """)
 
-        # tabela vitima
+        # indice de busca textual (FTS5), sem acentos e com prefixos
         cur.execute("""
-        INSERT INTO Vitima (ID, Sexo)
-        SELECT DISTINCT pesid, sexo
-        FROM Source
-        WHERE pesid IS NOT NULL
+        CREATE VIRTUAL TABLE IF NOT EXISTS Busca USING fts5(
+            Tipo UNINDEXED,
+            Valor,
+            Contexto UNINDEXED,
+            RefID UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
         """)
 
-        # tabela clima
+        # agregados por dia x hora
         cur.execute("""
-        INSERT INTO Condicao_climatica (Fase_dia, Descricao)
-        SELECT DISTINCT fase_dia, condicao_metereologica
-        FROM Source
+        CREATE TABLE IF NOT EXISTS Rollup_delegacia (
+            Dia INTEGER NOT NULL,
+            Hora INTEGER NOT NULL,
+            DID TEXT NOT NULL,
+            Total INTEGER NOT NULL,
+            PRIMARY KEY (Dia, Hora, DID),
+            FOREIGN KEY (DID) REFERENCES Delegacia(ID)
+        ) WITHOUT ROWID
         """)
 
-        # tabela delegacia
         cur.execute("""
-        INSERT INTO Delegacia (ID, Regional, UOP)
-        SELECT delegacia, regional, uop
-        FROM Source
-        WHERE delegacia IS NOT NULL
-        GROUP BY delegacia
+        CREATE TABLE IF NOT EXISTS Rollup_classificacao (
+            Dia INTEGER NOT NULL,
+            Hora INTEGER NOT NULL,
+            Classificacao TEXT NOT NULL,
+            Total INTEGER NOT NULL,
+            PRIMARY KEY (Dia, Hora, Classificacao)
+        ) WITHOUT ROWID
         """)
 
-        # tabela municipio
+        # vitimas por estado fisico; CID da a fase do dia e o clima
         cur.execute("""
-        INSERT INTO Municipio (Nome, UF)
-        SELECT DISTINCT municipio, uf
-        FROM Source
-        WHERE municipio IS NOT NULL AND uf IS NOT NULL
+        CREATE TABLE IF NOT EXISTS Rollup_estado_fisico (
+            Estado_fisico TEXT NOT NULL,
+            Dia INTEGER NOT NULL,
+            Hora INTEGER NOT NULL,
+            CID INTEGER NOT NULL,
+            Total INTEGER NOT NULL,
+            PRIMARY KEY (Estado_fisico, Dia, Hora, CID),
+            FOREIGN KEY (CID) REFERENCES Condicao_climatica(ID)
+        ) WITHOUT ROWID
         """)
 
-        # tabela trecho
+        # catalogo: valores de cada dimensao usada nos filtros e suas contagens
         cur.execute("""
-        INSERT INTO Trecho (Area_urbana, Br, Km, Tipo_pista, Sentido_via, MID)
-        SELECT DISTINCT
-            CASE WHEN s.uso_solo = "Sim" THEN 1 ELSE 0 END,
-            s.br,
-            s.km,
-            s.tipo_pista,
-            s.sentido_via,
-            m.ID
-        FROM Source s
-        LEFT JOIN Municipio m
-        ON m.Nome = s.municipio AND
-        m.uf = s.uf
-        WHERE s.uso_solo IS NOT NULL
-        AND s.br IS NOT NULL
-        AND s.km IS NOT NULL
-        AND s.tipo_pista IS NOT NULL
-        AND s.sentido_via IS NOT NULL
+        CREATE TABLE IF NOT EXISTS Dominio (
+            Dimensao TEXT NOT NULL,
+            Valor,
+            Linhas INTEGER NOT NULL
+        )
         """)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_dominio ON Dominio (Dimensao)')
 
-        #tabela Tracado_via
         cur.execute("""
-        SELECT DISTINCT s.tracado_via, t.ID
-        FROM Source s
-        LEFT JOIN Municipio m
-        ON m.Nome = s.municipio
-        AND m.UF = s.uf
-        LEFT JOIN Trecho t
-        ON t.Area_urbana = CASE
-                                WHEN s.uso_solo = 'Sim' THEN TRUE
-                                WHEN s.uso_solo = 'Não' THEN FALSE
-                                ELSE NULL
-                            END
-        AND t.Br = s.br
-        AND t.Km = s.km
-        AND t.Tipo_pista = s.tipo_pista
-        AND t.Sentido_via = s.sentido_via
-        AND t.MID = m.ID
-        WHERE s.tracado_via IS NOT NULL
+        CREATE TABLE IF NOT EXISTS Catalogo (
+            Dimensao TEXT PRIMARY KEY,
+            Cardinalidade INTEGER NOT NULL,
+            Linhas INTEGER NOT NULL
+        )
         """)
 
-        # tabela acidente
+        # estratos (UF x classificacao) e seus tamanhos
         cur.execute("""
-        INSERT INTO Acidente (ID, Data, Horario, Latitude, Longitude, Classificacao, TID, CID, DID)
-        SELECT DISTINCT
-            s.id AS SourceID,
-            s.data_inversa AS Data,
-            s.horario AS Horario,
-            s.latitude,
-            s.longitude,
-            s.classificacao_acidente AS Classificacao,
-            t.ID AS TID,
-            c.ID AS CID,
-            d.ID AS DID
-        FROM Source s
-        LEFT JOIN Municipio m
-        ON m.Nome = s.municipio
-        AND m.UF = s.uf
-        LEFT JOIN Trecho t
-        ON t.Br = s.br
-        AND t.Km = s.km
-        AND t.Sentido_via = s.sentido_via
-        AND t.Tipo_pista = s.tipo_pista
-        AND t.Area_urbana = CASE
-                                WHEN s.uso_solo = 'Sim' THEN TRUE
-                                WHEN s.uso_solo = 'Não' THEN FALSE
-                                ELSE NULL
-                            END
-        AND t.MID = m.ID
-        LEFT JOIN Tracado_via tv
-        ON tv.TID = t.ID
-        LEFT JOIN Condicao_climatica c
-        ON c.Descricao = s.condicao_metereologica
-        AND c.Fase_dia = s.fase_dia
-        LEFT JOIN Delegacia d
-        ON d.ID = s.delegacia
-        WHERE s.id IS NOT NULL
-        AND s.data_inversa IS NOT NULL
-        AND s.horario IS NOT NULL
-        AND s.classificacao_acidente IS NOT NULL
+        CREATE TABLE IF NOT EXISTS Estrato (
+            Nome TEXT PRIMARY KEY,
+            Total INTEGER NOT NULL
+        )
         """)
 
-        # tabela envolveu veiculo
+        # amostra estratificada de acidentes; Nivel e o indice da menor
+        # fracao de amostragem que inclui o acidente
         cur.execute("""
-        INSERT INTO Envolveu_veiculo (AID, VID)
-        SELECT DISTINCT id, id_veiculo
-        FROM Source
+        CREATE TABLE IF NOT EXISTS Amostra (
+            AID INTEGER PRIMARY KEY,
+            Estrato TEXT NOT NULL,
+            Nivel INTEGER NOT NULL,
+            FOREIGN KEY (AID) REFERENCES Acidente(ID),
+            FOREIGN KEY (Estrato) REFERENCES Estrato(Nome)
+        )
         """)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_amostra_nivel ON Amostra (Nivel)')
+        
+        self.conn.commit()
 
-        # tabela envolveu vitima
-        cur.execute("""
-        INSERT INTO Envolveu_vitima (PID, AID, Idade, Estado_fisico)
-        SELECT DISTINCT pesid, id, idade, estado_fisico
-        FROM Source
 
-        """)
+    def populate_db(self):
+        if self.complete:
+            return
+        
+        cur = self.conn.cursor()
 
-        # tabela tem causa
-        cur.execute("""
-        INSERT INTO Tem_causa (AID, CID, Principal)
-        SELECT DISTINCT Source.id, Causa.ID, Source.causa_principal
-        FROM Source, Causa
-        WHERE Source.causa_acidente = Causa.Descricao
+        # tamanho da amostra de um estrato com Total acidentes
+        def tamanho(fracao):
+            return f'MIN(Total, MAX(CAST({fracao} * Total AS INTEGER), {self.min_estrato}))'
+
+        niveis = ' '.join(f'WHEN Ordem <= {tamanho(f)} THEN {i}' for i, f in enumerate(self.fracoes_amostra))
+
+        # (tabela, dependencias, instrucao); todas dependem de Source
+        etapas = [
+            # tabela causa
+            ('Causa', [], """
+            INSERT INTO Causa (Descricao)
+            SELECT DISTINCT causa_acidente
+            FROM Source
+            WHERE causa_acidente IS NOT NULL
+            """),
+
+            # tabela veiculo
+            ('Veiculo', [], """
+            INSERT INTO Veiculo (ID, Tipo, Marca, Ano_fabricacao)
+            SELECT DISTINCT id_veiculo, tipo_veiculo, marca, ano_fabricacao_veiculo
+            FROM Source
+            WHERE id_veiculo IS NOT NULL
+            """),
+
+            # tabela vitima
+            ('Vitima', [], """
+            INSERT INTO Vitima (ID, Sexo)
+            SELECT DISTINCT pesid, sexo
+            FROM Source
+            WHERE pesid IS NOT NULL
+            """),
+
+            # tabela clima
+            ('Condicao_climatica', [], """
+            INSERT INTO Condicao_climatica (Fase_dia, Descricao)
+            SELECT DISTINCT fase_dia, condicao_metereologica
+            FROM Source
+            """),
+
+            # tabela delegacia
+            ('Delegacia', [], """
+            INSERT INTO Delegacia (ID, Regional, UOP)
+            SELECT delegacia, regional, uop
+            FROM Source
+            WHERE delegacia IS NOT NULL
+            GROUP BY delegacia
+            """),
+
+            # tabela municipio
+            ('Municipio', [], """
+            INSERT INTO Municipio (Nome, UF)
+            SELECT DISTINCT municipio, uf
+            FROM Source
+            WHERE municipio IS NOT NULL AND uf IS NOT NULL
+            """),
+
+            # tabela trecho
+            ('Trecho', ['Municipio'], """
+            INSERT INTO Trecho (Area_urbana, Br, Km, Tipo_pista, Sentido_via, MID)
+            SELECT DISTINCT
+                CASE WHEN s.uso_solo = "Sim" THEN 1 ELSE 0 END,
+                s.br,
+                s.km,
+                s.tipo_pista,
+                s.sentido_via,
+                m.ID
+            FROM Source s
+            LEFT JOIN Municipio m
+            ON m.Nome = s.municipio AND
+            m.uf = s.uf
+            WHERE s.uso_solo IS NOT NULL
+            AND s.br IS NOT NULL
+            AND s.km IS NOT NULL
+            AND s.tipo_pista IS NOT NULL
+            AND s.sentido_via IS NOT NULL
+            """),
+
+            # tabela Tracado_via
+            ('Tracado_via', ['Municipio', 'Trecho'], """
+            INSERT INTO Tracado_via (Tipo, TID)
+            SELECT DISTINCT s.tracado_via, t.ID
+            FROM Source s
+            LEFT JOIN Municipio m
+            ON m.Nome = s.municipio
+            AND m.UF = s.uf
+            LEFT JOIN Trecho t
+            ON t.Area_urbana = CASE
+                                    WHEN s.uso_solo = 'Sim' THEN TRUE
+                                    WHEN s.uso_solo = 'Não' THEN FALSE
+                                    ELSE NULL
+                                END
+            AND t.Br = s.br
+            AND t.Km = s.km
+            AND t.Tipo_pista = s.tipo_pista
+            AND t.Sentido_via = s.sentido_via
+            AND t.MID = m.ID
+            WHERE s.tracado_via IS NOT NULL
+            """),
+
+            # tabela acidente
+            ('Acidente', ['Municipio', 'Trecho', 'Tracado_via', 'Condicao_climatica', 'Delegacia'], """
+            INSERT INTO Acidente (ID, Data, Horario, Dia, Minuto, Latitude, Longitude, Classificacao, TID, CID, DID)
+            SELECT DISTINCT
+                s.id AS SourceID,
+                s.data_inversa AS Data,
+                s.horario AS Horario,
+                CAST(CASE
+                        WHEN s.data_inversa LIKE '__/__/____'
+                        THEN substr(s.data_inversa, 7, 4) || substr(s.data_inversa, 4, 2) || substr(s.data_inversa, 1, 2)
+                        ELSE REPLACE(s.data_inversa, '-', '')
+                    END AS INTEGER) AS Dia,
+                CAST(substr(s.horario, 1, 2) AS INTEGER) * 60 + CAST(substr(s.horario, 4, 2) AS INTEGER) AS Minuto,
+                s.latitude,
+                s.longitude,
+                s.classificacao_acidente AS Classificacao,
+                t.ID AS TID,
+                c.ID AS CID,
+                d.ID AS DID
+            FROM Source s
+            LEFT JOIN Municipio m
+            ON m.Nome = s.municipio
+            AND m.UF = s.uf
+            LEFT JOIN Trecho t
+            ON t.Br = s.br
+            AND t.Km = s.km
+            AND t.Sentido_via = s.sentido_via
+            AND t.Tipo_pista = s.tipo_pista
+            AND t.Area_urbana = CASE
+                                    WHEN s.uso_solo = 'Sim' THEN TRUE
+                                    WHEN s.uso_solo = 'Não' THEN FALSE
+                                    ELSE NULL
+                                END
+            AND t.MID = m.ID
+            LEFT JOIN Tracado_via tv
+            ON tv.TID = t.ID
+            LEFT JOIN Condicao_climatica c
+            ON c.Descricao = s.condicao_metereologica
+            AND c.Fase_dia = s.fase_dia
+            LEFT JOIN Delegacia d
+            ON d.ID = s.delegacia
+            WHERE s.id IS NOT NULL
+            AND s.data_inversa IS NOT NULL
+            AND s.horario IS NOT NULL
+            AND s.classificacao_acidente IS NOT NULL
+            """),
+
+            # tabela envolveu veiculo
+            ('Envolveu_veiculo', [], """
+            INSERT INTO Envolveu_veiculo (AID, VID)
+            SELECT DISTINCT id, id_veiculo
+            FROM Source
+            """),
+
+            # tabela envolveu vitima
+            ('Envolveu_vitima', [], """
+            INSERT INTO Envolveu_vitima (PID, AID, Idade, Estado_fisico)
+            SELECT DISTINCT pesid, id, idade, estado_fisico
+            FROM Source
+
+            """),
+
+            # tabela tem causa
+            ('Tem_causa', ['Causa'], """
+            INSERT INTO Tem_causa (AID, CID, Principal)
+            SELECT DISTINCT Source.id, Causa.ID, Source.causa_principal
+            FROM Source, Causa
+            WHERE Source.causa_acidente = Causa.Descricao
+
+            """),
+
+            # indice espacial: latitude/longitude vem como texto com virgula decimal
+            ('Acidente_geo', ['Acidente'], """
+            INSERT INTO Acidente_geo (ID, min_lat, max_lat, min_lon, max_lon)
+            SELECT ID, lat, lat, lon, lon
+            FROM (
+                SELECT
+                    ID,
+                    CAST(REPLACE(Latitude, ',', '.') AS REAL) AS lat,
+                    CAST(REPLACE(Longitude, ',', '.') AS REAL) AS lon
+                FROM Acidente
+                WHERE Latitude IS NOT NULL
+                AND Longitude IS NOT NULL
+            )
+            """),
+
+            # indice de busca: municipios, causas e marcas
+            ('Busca', ['Municipio', 'Causa', 'Veiculo'], """
+            INSERT INTO Busca (Tipo, Valor, Contexto, RefID)
+            SELECT 'municipio', Nome, UF, ID FROM Municipio WHERE Nome IS NOT NULL
+            UNION ALL
+            SELECT 'causa', Descricao, NULL, ID FROM Causa WHERE Descricao IS NOT NULL
+            UNION ALL
+            SELECT DISTINCT 'marca', Marca, NULL, NULL FROM Veiculo WHERE Marca IS NOT NULL
+            """),
+
+            # agregados dia x hora
+            ('Rollup_delegacia', ['Acidente'], """
+            INSERT INTO Rollup_delegacia (Dia, Hora, DID, Total)
+            SELECT Dia, Minuto / 60, DID, COUNT(*)
+            FROM Acidente
+            WHERE Dia IS NOT NULL AND Minuto IS NOT NULL
+            AND DID IS NOT NULL
+            GROUP BY Dia, Minuto / 60, DID
+            """),
+
+            ('Rollup_classificacao', ['Acidente'], """
+            INSERT INTO Rollup_classificacao (Dia, Hora, Classificacao, Total)
+            SELECT Dia, Minuto / 60, Classificacao, COUNT(*)
+            FROM Acidente
+            WHERE Dia IS NOT NULL AND Minuto IS NOT NULL
+            AND Classificacao IS NOT NULL
+            GROUP BY Dia, Minuto / 60, Classificacao
+            """),
+
+            ('Rollup_estado_fisico', ['Acidente', 'Envolveu_vitima'], """
+            INSERT INTO Rollup_estado_fisico (Estado_fisico, Dia, Hora, CID, Total)
+            SELECT ev.Estado_fisico, at.Dia, at.Minuto / 60, at.CID, COUNT(*)
+            FROM Acidente at
+            JOIN Envolveu_vitima ev
+            ON ev.AID = at.ID
+            WHERE ev.Estado_fisico IS NOT NULL
+            AND at.Dia IS NOT NULL AND at.Minuto IS NOT NULL
+            AND at.CID IS NOT NULL
+            GROUP BY ev.Estado_fisico, at.Dia, at.Minuto / 60, at.CID
+            """),
+
+            # dominios: acidentes por UF e por BR, acidentes por classificacao
+            # e vitimas por estado fisico
+            ('Dominio', ['Municipio', 'Trecho', 'Acidente', 'Envolveu_vitima'], """
+            INSERT INTO Dominio (Dimensao, Valor, Linhas)
+            SELECT 'estado', m.UF, COUNT(ac.ID)
+            FROM Municipio m
+            LEFT JOIN Trecho t
+            ON t.MID = m.ID
+            LEFT JOIN Acidente ac
+            ON ac.TID = t.ID
+            GROUP BY m.UF
+            UNION ALL
+            SELECT 'br', t.Br, COUNT(ac.ID)
+            FROM Trecho t
+            LEFT JOIN Acidente ac
+            ON ac.TID = t.ID
+            WHERE t.Br IS NOT NULL
+            GROUP BY t.Br
+            UNION ALL
+            SELECT 'classificacao', Classificacao, COUNT(*)
+            FROM Acidente
+            GROUP BY Classificacao
+            UNION ALL
+            SELECT 'estado_fisico', Estado_fisico, COUNT(*)
+            FROM Envolveu_vitima
+            GROUP BY Estado_fisico
+            """),
+
+            ('Catalogo', ['Dominio'], """
+            INSERT INTO Catalogo (Dimensao, Cardinalidade, Linhas)
+            SELECT Dimensao, COUNT(*), SUM(Linhas)
+            FROM Dominio
+            GROUP BY Dimensao
+            """),
+
+            # estratos da amostra: UF x classificacao
+            ('Estrato', ['Acidente', 'Trecho', 'Municipio'], """
+            INSERT INTO Estrato (Nome, Total)
+            SELECT COALESCE(m.UF, '?') || '|' || COALESCE(ac.Classificacao, '?'), COUNT(*)
+            FROM Acidente ac
+            LEFT JOIN Trecho t
+            ON t.ID = ac.TID
+            LEFT JOIN Municipio m
+            ON m.ID = t.MID
+            GROUP BY 1
+            """),
+
+            # amostra: ordem aleatoria dentro de cada estrato
+            ('Amostra', ['Estrato', 'Acidente', 'Trecho', 'Municipio'], f"""
+            INSERT INTO Amostra (AID, Estrato, Nivel)
+            SELECT AID, Estrato, CASE {niveis} END
+            FROM (
+                SELECT
+                    ac.ID AS AID,
+                    e.Nome AS Estrato,
+                    e.Total,
+                    ROW_NUMBER() OVER (PARTITION BY e.Nome ORDER BY RANDOM()) AS Ordem
+                FROM Acidente ac
+                LEFT JOIN Trecho t
+                ON t.ID = ac.TID
+                LEFT JOIN Municipio m
+                ON m.ID = t.MID
+                JOIN Estrato e
+                ON e.Nome = COALESCE(m.UF, '?') || '|' || COALESCE(ac.Classificacao, '?')
+            )
+            WHERE Ordem <= {tamanho(self.fracoes_amostra[-1])}
+            """),
+        ]
+
+        concluidas = {tabela for tabela, _, _ in etapas if self._concluida(tabela)}
+        pendentes = [etapa for etapa in etapas if etapa[0] not in concluidas]
+
+        # cada onda reune as etapas cujas dependencias ja estao concluidas
+        while pendentes:
+            onda = [etapa for etapa in pendentes if all(d in concluidas for d in etapa[1])]
+
+            if len(onda) == 1:
+                tabela, _, instrucao = onda[0]
+                self._run_stage(tabela, instrucao)
+            else:
+                self._run_parallel(onda)
 
-        """)
+            for tabela, _, _ in onda:
+                concluidas.add(tabela)
+                linhas, segundos = self.fetch(
+                    'SELECT Linhas, Segundos FROM Checkpoint WHERE Etapa = ?', False, (tabela,)
+                )[0]
+                self._report('populacao', tabela=tabela, feitas=len(concluidas), total=len(etapas),
+                             linhas=linhas, segundos=segundos)
+            pendentes = [etapa for etapa in pendentes if etapa not in onda]
 
         # Excluindo Source---------------------------------------
-        cur.execute("DROP TABLE Source")
+        cur.execute("DROP TABLE IF EXISTS Source")
+        self._checkpoint('limpeza', 0, 0.0)
+        self.conn.commit()
+
+
+    def _concluida(self, etapa):
+        return bool(self.fetch('SELECT 1 FROM Checkpoint WHERE Etapa = ?', False, (etapa,)))
+
+
+    def _checkpoint(self, etapa, linhas, segundos):
+        # gravado na mesma transacao que os dados da etapa
+        self.conn.execute(
+            "INSERT OR REPLACE INTO Checkpoint (Etapa, Linhas, Segundos, Concluida) VALUES (?, ?, ?, datetime('now'))",
+            (etapa, linhas, segundos)
+        )
+
+
+    def _run_stage(self, tabela, instrucao):
+        inicio = time.perf_counter()
+        cur = self.conn.cursor()
+
+        # descarta o que sobrou de uma tentativa anterior
+        cur.execute(f'DELETE FROM "{tabela}"')
+        cur.execute(instrucao)
+        self._checkpoint(tabela, cur.rowcount, time.perf_counter() - inicio)
+        self.conn.commit()
+
+
+    def _scratch_name(self, tabela):
+        return f'{self.db_name}.{tabela}.etapa'
+
+
+    def _run_scratch(self, tabela, instrucao):
+        # roda a etapa num banco proprio, lendo o principal (somente leitura) anexado
+        inicio = time.perf_counter()
+        scratch = self._scratch_name(tabela)
+        if os.path.isfile(scratch):
+            os.remove(scratch)
+
+        conn = sqlite3.connect(f'file:{os.path.abspath(scratch)}', uri=True)
+        try:
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('ATTACH DATABASE ? AS principal',
+                         (f'file:{os.path.abspath(self.db_name)}?mode=ro',))
+
+            # mesma definicao da tabela; nomes nao qualificados leem do principal
+            ddl = conn.execute('SELECT sql FROM principal.sqlite_master WHERE name = ?', (tabela,)).fetchone()[0]
+            conn.execute(ddl)
+            linhas = conn.execute(instrucao).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+
+        return linhas, time.perf_counter() - inicio
+
+
+    def _run_parallel(self, onda):
+        # o principal nao pode ter transacao aberta enquanto as etapas o leem
         self.conn.commit()
 
+        with ThreadPoolExecutor(max_workers=min(len(onda), os.cpu_count() or 1)) as pool:
+            futuros = [(tabela, pool.submit(self._run_scratch, tabela, instrucao)) for tabela, _, instrucao in onda]
+
+        # mescla somente depois que todas terminaram de ler o principal
+        erros = []
+        for tabela, futuro in futuros:
+            if futuro.exception() is not None:
+                erros.append(futuro.exception())
+                continue
+
+            linhas, segundos = futuro.result()
+            inicio = time.perf_counter()
+            scratch = self._scratch_name(tabela)
+
+            self.conn.execute('ATTACH DATABASE ? AS etapa', (scratch,))
+            self.conn.execute(f'DELETE FROM main."{tabela}"')
+            self.conn.execute(f'INSERT INTO main."{tabela}" SELECT * FROM etapa."{tabela}"')
+            self._checkpoint(tabela, linhas, segundos + time.perf_counter() - inicio)
+            self.conn.commit()
+            self.conn.execute('DETACH DATABASE etapa')
+            os.remove(scratch)
+
+        if erros:
+            raise erros[0]
+
+
+    def stages(self):
+        # tempo e linhas de cada etapa do build
+        return self.fetch('SELECT Etapa, Linhas, Segundos, Concluida FROM Checkpoint ORDER BY rowid')
 
 if __name__ == '__main__':
     db = Database()
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from database import Database
+
+try:
+    import fcntl
+except ImportError:
+    # fora do POSIX o lock vale so entre as threads deste processo
+    fcntl = None
+
+
+class Ingestion:
+    """
+    Constroi o banco em segundo plano e publica o arquivo pronto.
+
+    O build roda numa thread, sob um lock de arquivo (um unico build entre
+    processos; sem fcntl, como no Windows, so entre as threads do processo),
+    num arquivo temporario que so substitui db_name quando termina; um build
+    interrompido continua do ultimo checkpoint. O andamento fica num JSON
+    lido por status().
+    """
+    db_name = Database.db_name
+    build_name = db_name + ".build"
+    lock_name = db_name + ".lock"
+    progress_name = db_name + ".progress.json"
+
+    # intervalo minimo entre gravacoes do progresso da mesma fase
+    intervalo = 0.5
+
+    # um build por vez entre as instancias do processo; entre processos,
+    # so com fcntl
+    _lock_local = threading.Lock()
+
+    def __init__(self):
+        self._thread = None
+        self._mutex = threading.Lock()
+        self._ultima = (None, 0.0)
+
+
+    def ready(self):
+        # so conta um banco publicado por um build completo; um arquivo vazio
+        # ou de uma versao anterior do esquema e reconstruido
+        if not os.path.isfile(self.db_name):
+            return False
+
+        try:
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.db_name)}?mode=ro", uri=True)
+            try:
+                return conn.execute("SELECT 1 FROM Checkpoint WHERE Etapa = 'limpeza'").fetchone() is not None
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def status(self):
+        try:
+            with open(self.progress_name) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+    def start(self):
+        with self._mutex:
+            if self.ready() or self.running():
+                return self
+
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+        return self
+
+
+    def _save(self, fase, **dados):
+        # limita a frequencia de escrita, exceto quando a fase muda
+        agora = time.time()
+        ultima_fase, ultimo = self._ultima
+        if fase == ultima_fase and agora - ultimo < self.intervalo:
+            return
+        self._ultima = (fase, agora)
+
+        tmp = self.progress_name + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict(dados, fase=fase, atualizado=agora), f)
+        os.replace(tmp, self.progress_name)
+
+
+    def _run(self):
+        with open(self.lock_name, "a") as lock, self._lock_local:
+            # bloqueia enquanto outro processo constroi; se ele morrer, assumimos
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self.ready():
+                    return
+
+                # so quem tem o lock escreve o progresso
+                self._save('inicio')
+
+                # um build abandonado e retomado pelos checkpoints do Database
+                db = Database(self.build_name, progress=self._save)
+                db.download_and_extract()
+                db.create_db()
+                db.populate_db()
+                db.conn.close()
+
+                os.replace(self.build_name, self.db_name)
+                self._save('pronto')
+
+            except Exception as e:
+                self._save('erro', erro=str(e))
+
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,99 @@
+class Rejeitada(Exception):
+    """
+    Linha descartada pelo pipeline; a mensagem e o motivo.
+    """
+
+
+class Pipeline:
+    """
+    Aplica, linha a linha, uma sequencia de transformacoes sobre o CSV.
+
+    Cada transformacao recebe o cabecalho e devolve uma funcao que recebe
+    a linha (lista de valores) e devolve a linha transformada, ou levanta
+    Rejeitada para descarta-la.
+    """
+
+    def __init__(self, header, *transformacoes):
+        self.header = header
+        self.etapas = [transformacao(header) for transformacao in transformacoes]
+
+    def __call__(self, linha):
+        if len(linha) != len(self.header):
+            raise Rejeitada(f'{len(linha)} colunas, esperadas {len(self.header)}')
+
+        for etapa in self.etapas:
+            linha = etapa(linha)
+
+        return linha
+
+
+def aparar():
+    def etapa(header):
+        return lambda linha: [None if value is None else value.strip() for value in linha]
+    return etapa
+
+
+def nulos(valores=("NA", "N/A", "", "NA/NA")):
+    # substitui valores específicos como 'NA' por None
+    def etapa(header):
+        return lambda linha: [None if value in valores else value for value in linha]
+    return etapa
+
+
+def converter(coluna, funcao):
+    # converte a coluna com `funcao`; valor que nao converte rejeita a linha
+    def etapa(header):
+        i = header.index(coluna)
+
+        def aplicar(linha):
+            if linha[i] is not None:
+                try:
+                    linha[i] = funcao(linha[i])
+                except (ValueError, OverflowError):
+                    raise Rejeitada(f'{coluna} invalido: {linha[i]!r}')
+            return linha
+
+        return aplicar
+    return etapa
+
+
+def inteiro(coluna):
+    # como CAST(... AS INTEGER): aceita "45" e "45.0"
+    return converter(coluna, lambda value: int(float(value)))
+
+
+def decimal(coluna):
+    # decimais do CSV usam virgula
+    return converter(coluna, lambda value: float(value.replace(',', '.')))
+
+
+def mapear(coluna, valores):
+    # valores fora do mapa viram None
+    return converter(coluna, valores.get)
+
+
+def maximo(coluna, limite):
+    def etapa(header):
+        i = header.index(coluna)
+
+        def aplicar(linha):
+            if linha[i] is not None and linha[i] > limite:
+                raise Rejeitada(f'{coluna} acima de {limite}: {linha[i]}')
+            return linha
+
+        return aplicar
+    return etapa
+
+
+def obrigatorias(*colunas):
+    def etapa(header):
+        indices = [(coluna, header.index(coluna)) for coluna in colunas]
+
+        def aplicar(linha):
+            for coluna, i in indices:
+                if linha[i] is None:
+                    raise Rejeitada(f'{coluna} nulo')
+            return linha
+
+        return aplicar
+    return etapa